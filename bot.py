@@ -1,11 +1,28 @@
 import time
-import json
+import hashlib
+import html
+import io
 import os
+import random
 import re
-import feedparser
+import signal
+import sys
+import queue
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import ahocorasick
+import orjson
 import requests
-from bs4 import BeautifulSoup
-from telegram import Bot
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from telegram import Bot, InputMediaPhoto, ParseMode, Update
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.utils.request import Request
 import logging
 
 # -----------------------------
@@ -19,10 +36,17 @@ log = logging.getLogger("watchbot")
 # -----------------------------
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
-# Интервал проверки Reddit (секунды)
-CHECK_INTERVAL_RSS = int(os.getenv("CHECK_INTERVAL", "60"))
+# Интервал проверки Reddit (секунды; не меньше 1 — сетка расписания делит на него)
+CHECK_INTERVAL_RSS = max(1, int(os.getenv("CHECK_INTERVAL", "60")))
+# Случайная добавка к паузе между проверками (секунды), чтобы не бить в Reddit строго по сетке
+RSS_JITTER = float(os.getenv("RSS_JITTER", "5"))
+# Потолок интервала: после пустых проверок (ночью) интервал удваивается до этого значения
+RSS_MAX_INTERVAL = max(CHECK_INTERVAL_RSS, int(os.getenv("RSS_MAX_INTERVAL", "600")))
 
-# Как часто опрашивать Telegram (секунды)
+# Сколько секунд держать long-poll запрос к Telegram
+TELEGRAM_LONG_POLL_TIMEOUT = int(os.getenv("TELEGRAM_LONG_POLL_TIMEOUT", "50"))
+
+# Пауза перед повтором, если опрос Telegram упал (секунды)
 TELEGRAM_POLL_INTERVAL = float(os.getenv("TELEGRAM_POLL_INTERVAL", "2"))
 
 # RSS-лента
@@ -30,19 +54,47 @@ RSS_URL = os.getenv(
     "RSS_FEED",
     "https://old.reddit.com/r/Watchexchange/new/.rss",
 )
-
-log.info(f"RSS_URL = {RSS_URL}")
+# Несколько лент через запятую (например, ещё сабреддиты); по умолчанию — одна RSS_URL
+RSS_URLS = [u.strip() for u in os.getenv("RSS_FEEDS", RSS_URL).split(",") if u.strip()]
+# Сколько лент качаем одновременно
+RSS_FETCH_WORKERS = 4
+
+# Вебхук вместо long polling, если у платформы есть входящий HTTPS
+# (например, web-процесс). Пусто — работаем через getUpdates.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+# секретный путь, чтобы чужие POST не доходили до бота (сам токен в URL не светим)
+WEBHOOK_PATH = "/webhook/" + hashlib.sha256((TELEGRAM_TOKEN or "").encode()).hexdigest()[:32]
+
+log.info(f"RSS_URLS = {RSS_URLS}")
+if not RSS_URLS:
+    log.error("RSS_FEED / RSS_FEEDS is empty, RSS checks are disabled!")
 log.info(f"CHECK_INTERVAL_RSS = {CHECK_INTERVAL_RSS}")
+log.info(f"RSS_JITTER = {RSS_JITTER}")
+log.info(f"RSS_MAX_INTERVAL = {RSS_MAX_INTERVAL}")
+log.info(f"TELEGRAM_LONG_POLL_TIMEOUT = {TELEGRAM_LONG_POLL_TIMEOUT}")
 log.info(f"TELEGRAM_POLL_INTERVAL = {TELEGRAM_POLL_INTERVAL}")
+log.info(f"WEBHOOK_URL = {WEBHOOK_URL or 'disabled (long polling)'}")
 
-bot = Bot(token=TELEGRAM_TOKEN)
+# Потоков-отправителей из очереди outbox
+SEND_WORKERS = 8
+
+# По умолчанию у PTB пул на одно соединение — отправители стояли бы в очереди за ним.
+# Каждому отправителю своё соединение + long poll / вебхук + запас
+bot = Bot(
+    token=TELEGRAM_TOKEN,
+    request=Request(con_pool_size=SEND_WORKERS + 4),
+)
 
 # -----------------------------
 # STORAGE (на Volume)
 # -----------------------------
 DATA_DIR = "/mnt/data"
 SEEN_FILE = os.path.join(DATA_DIR, "seen.json")
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
+SEEN_LOG = os.path.join(DATA_DIR, "seen.log")
+USERS_FILE = os.path.join(DATA_DIR, "users.json")  # старый формат, только для миграции
+USERS_DIR = os.path.join(DATA_DIR, "users")
+FEED_CACHE_FILE = os.path.join(DATA_DIR, "feed_cache.json")
 
 
 def ensure_data_dir():
@@ -52,125 +104,539 @@ def ensure_data_dir():
         log.error(f"Error creating data directory: {e}")
 
 
+def _json_default(obj):
+    """SeenSet (например, cfg["sent"]) сохраняем как обычный список."""
+    if isinstance(obj, SeenSet):
+        return list(obj)
+    raise TypeError
+
+
+def write_json_atomic(path: str, data):
+    """Пишем во временный файл и подменяем через os.replace — без битых файлов при падении."""
+    payload = orjson.dumps(data, default=_json_default)
+    # Уникальное имя: писатель настроек и основной цикл не затирают чужой tmp
+    tmp = tempfile.NamedTemporaryFile(
+        "wb", dir=os.path.dirname(path), prefix=".tmp-", delete=False
+    )
+    try:
+        with tmp:
+            tmp.write(payload)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp.name, path)
+    except BaseException:
+        # не оставляем .tmp-* в DATA_DIR, если упали на записи (ENOSPC) или replace
+        os.unlink(tmp.name)
+        raise
+
+
+# Сколько id копим в seen.log до пересборки seen.json
+SEEN_COMPACT_EVERY = 1000
+
+# Сколько последних id постов помним (RSS отдаёт только ~25 свежих)
+MAX_SEEN = int(os.getenv("MAX_SEEN", "2048"))
+
+# Сколько последних доставленных постов помним для каждого пользователя
+MAX_SENT_PER_USER = 256
+
+
+class SeenSet:
+    """Множество id с ограниченным размером: самые старые вытесняются первыми."""
+
+    def __init__(self, items=(), maxlen=MAX_SEEN):
+        self.maxlen = maxlen
+        self._items = OrderedDict()
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __iter__(self):
+        # снимок: множество могут пополнять потоки-отправщики
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        self._items[item] = None
+        self._items.move_to_end(item)
+        while len(self._items) > self.maxlen:
+            self._items.popitem(last=False)
+
+
 def load_seen():
+    """
+    seen.json — снапшот, seen.log — id, добавленные после него (по одному на строку).
+    Порядок сохраняется (от старых к новым), чтобы вытеснение шло с нужного конца.
+    """
+    seen = SeenSet()
     try:
-        with open(SEEN_FILE, "r") as f:
-            data = json.load(f)
-            seen = set(data)
-            log.info(f"Loaded seen_posts: {len(seen)} items")
-            return seen
+        with open(SEEN_FILE, "rb") as f:
+            for post_id in orjson.loads(f.read()):
+                seen.add(post_id)
     except FileNotFoundError:
         log.info("seen.json not found, starting with empty set")
-        return set()
     except Exception as e:
         log.error(f"Error loading seen.json: {e}")
-        return set()
 
-
-def save_seen(seen):
     try:
-        ensure_data_dir()
-        with open(SEEN_FILE, "w") as f:
-            json.dump(list(seen), f)
-        log.info(f"Saved seen_posts: {len(seen)} items")
+        with open(SEEN_LOG, "r") as f:
+            for line in f:
+                if line.strip():
+                    seen.add(line.strip())
+    except FileNotFoundError:
+        pass
     except Exception as e:
-        log.error(f"Error saving seen.json: {e}")
+        log.error(f"Error loading seen.log: {e}")
+
+    log.info(f"Loaded seen_posts: {len(seen)} items")
+    return seen
+
+
+# seen.log держим открытым между записями; сбрасывается при компакции
+_seen_log_file = None
+seen_log_count = 0
+
+# post_id -> сколько пачек с этим постом ещё не отправлено.
+# На диск (seen.log / seen.json) пост попадает только когда их станет 0:
+# после падения неотправленные посты придут снова, а cfg["sent"] не даст
+# повторить их тем, кому они уже ушли.
+_pending_posts = {}
+# общий для seen.log, seen.json и _pending_posts: отправщики пишут в лог,
+# пока основной поток делает компакцию
+_seen_lock = threading.RLock()
+
+
+def append_seen(post_ids):
+    """Дописываем новые id цикла в seen.log одной записью — без перезаписи seen.json."""
+    global _seen_log_file, seen_log_count
+    with _seen_lock:
+        try:
+            if _seen_log_file is None:
+                ensure_data_dir()
+                _seen_log_file = open(SEEN_LOG, "a")
+            _seen_log_file.write("".join(f"{post_id}\n" for post_id in post_ids))
+            _seen_log_file.flush()
+            seen_log_count += len(post_ids)
+        except Exception as e:
+            log.error(f"Error appending to seen.log: {e}")
+
+
+def hold_pending(post_ids):
+    """Посты ушли в очередь: каждое вхождение — одна пачка, которую ещё надо отправить."""
+    with _seen_lock:
+        for post_id in post_ids:
+            _pending_posts[post_id] = _pending_posts.get(post_id, 0) + 1
+
+
+def release_pending(post_ids):
+    """Пачка обработана: посты, у которых не осталось пачек, пишем в seen.log."""
+    with _seen_lock:
+        done = []
+        for post_id in post_ids:
+            left = _pending_posts.get(post_id, 0) - 1
+            if left > 0:
+                _pending_posts[post_id] = left
+            else:
+                _pending_posts.pop(post_id, None)
+                done.append(post_id)
+        if done:
+            append_seen(done)
+
+
+def save_seen(seen):
+    """Компакция: пишем полный снапшот в seen.json и обнуляем seen.log."""
+    global _seen_log_file, seen_log_count
+    with _seen_lock:
+        try:
+            ensure_data_dir()
+            # ещё не отправленные посты не сохраняем — после рестарта их надо дослать
+            write_json_atomic(SEEN_FILE, [p for p in seen if p not in _pending_posts])
+            if _seen_log_file is not None:
+                _seen_log_file.close()
+                _seen_log_file = None
+            open(SEEN_LOG, "w").close()
+            seen_log_count = 0
+            log.info(f"Saved seen_posts: {len(seen)} items, {len(_pending_posts)} pending")
+        except Exception as e:
+            log.error(f"Error saving seen.json: {e}")
+
+
+def _normalize_user_cfg(cfg):
+    cfg["keywords"] = [k.lower() for k in cfg.get("keywords", [])]
+    cfg["tracked_users"] = [u.lower() for u in cfg.get("tracked_users", [])]
+    cfg["paused"] = bool(cfg.get("paused", False))
+    cfg["sent"] = SeenSet(cfg.get("sent", []), maxlen=MAX_SENT_PER_USER)
+    return cfg
 
 
 def load_users():
     """
-    users.json формат:
+    Настройки хранятся по файлу на чат: users/<chat_id>.json
     {
-      "123456789": {
-          "keywords": ["seiko", "omega"],
-          "tracked_users": ["parentaladvice", "audaciousco"],
-          "paused": false
-      },
-      ...
+      "keywords": ["seiko", "omega"],
+      "tracked_users": ["parentaladvice", "audaciousco"],
+      "paused": false,
+      "sent": ["1abcde", ...]   # последние доставленные посты
     }
+    Старый общий users.json ({"<chat_id>": {...}, ...}) переносится при первом запуске.
     """
+    data = {}
+    try:
+        names = os.listdir(USERS_DIR)
+    except FileNotFoundError:
+        names = []
+    except Exception as e:
+        log.error(f"Error listing {USERS_DIR}: {e}")
+        names = []
+
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(USERS_DIR, name), "rb") as f:
+                data[name[:-len(".json")]] = _normalize_user_cfg(orjson.loads(f.read()))
+        except Exception as e:
+            log.error(f"Error loading users/{name}: {e}")
+
+    if not data:
+        data = _migrate_users_file()
+
+    log.info(f"Loaded users: {len(data)}")
+    return data
+
+
+def _migrate_users_file():
+    """Разбиваем старый users.json на файлы по чатам."""
     try:
-        with open(USERS_FILE, "r") as f:
-            data = json.load(f)
-            for chat_id, cfg in data.items():
-                cfg["keywords"] = [k.lower() for k in cfg.get("keywords", [])]
-                cfg["tracked_users"] = [u.lower() for u in cfg.get("tracked_users", [])]
-                cfg["paused"] = bool(cfg.get("paused", False))
-            log.info(f"Loaded users: {len(data)}")
-            return data
+        with open(USERS_FILE, "rb") as f:
+            data = orjson.loads(f.read())
     except FileNotFoundError:
-        log.info("users.json not found, starting with empty users")
+        log.info("No user settings found, starting with empty users")
         return {}
     except Exception as e:
         log.error(f"Error loading users.json: {e}")
         return {}
 
+    for chat_id_str, cfg in data.items():
+        _normalize_user_cfg(cfg)
+        save_user(chat_id_str, cfg)
+    log.info(f"Migrated users.json to {USERS_DIR}: {len(data)} users")
+    return data
+
+
+def save_user(chat_id_str: str, cfg):
+    """Пишем только файл одного чата — O(1) от числа пользователей."""
+    try:
+        os.makedirs(USERS_DIR, exist_ok=True)
+        write_json_atomic(os.path.join(USERS_DIR, f"{chat_id_str}.json"), cfg)
+    except Exception as e:
+        log.error(f"Error saving users/{chat_id_str}.json: {e}")
+
+
+def mark_users_dirty(chat_id_str: str, reindex: bool = True):
+    """
+    Настройки чата изменились — их сохранит поток users_writer.
+    reindex=False — поменялось только "sent", индекс рассылки пересобирать не надо.
+    """
+    global _index_dirty
+    _dirty_chats.add(chat_id_str)
+    if reindex:
+        _index_dirty = True
+    _users_dirty_event.set()
+
+
+# Сколько секунд копим изменения пользователей перед записью
+USERS_FLUSH_DELAY = 1.0
+
+
+def users_writer():
+    """Отдельный поток: пачка изменений за USERS_FLUSH_DELAY — одна запись."""
+    while True:
+        _users_dirty_event.wait()
+        time.sleep(USERS_FLUSH_DELAY)
+        _users_dirty_event.clear()
+        try:
+            flush_users()
+        except Exception as e:
+            log.error(f"Error flushing users: {e}")
+
+
+def flush_users():
+    global user_index, _index_dirty
+    # flush зовут users_writer и main при остановке — пишем по одному
+    with _users_save_lock:
+        if _index_dirty:
+            _index_dirty = False
+            user_index = rebuild_index(users)
+        while _dirty_chats:
+            chat_id_str = _dirty_chats.pop()
+            cfg = users.get(chat_id_str)
+            if cfg is not None:
+                save_user(chat_id_str, cfg)
+
+
+def rebuild_index(users):
+    """
+    Инвертированный индекс для рассылки:
+    keyword -> {chat_id}, author -> {chat_id}
+    и автомат Aho-Corasick по всем ключевым словам (None, если слов нет).
+    Пользователи на паузе в индекс не попадают.
+    """
+    keyword_to_chats = {}
+    author_to_chats = {}
+    for chat_id_str, cfg in list(users.items()):
+        if cfg.get("paused", False):
+            continue
+        chat_id = int(chat_id_str)
+        # intern: одинаковые слова у разных пользователей — один объект строки
+        for kw in cfg.get("keywords", []):
+            keyword_to_chats.setdefault(sys.intern(kw), set()).add(chat_id)
+        for author in cfg.get("tracked_users", []):
+            author_to_chats.setdefault(sys.intern(author), set()).add(chat_id)
+
+    keyword_matcher = None
+    if keyword_to_chats:
+        keyword_matcher = ahocorasick.Automaton()
+        for kw in keyword_to_chats:
+            keyword_matcher.add_word(kw, kw)
+        keyword_matcher.make_automaton()
+
+    return keyword_to_chats, author_to_chats, keyword_matcher
+
+
+def load_feed_cache():
+    """ETag / Last-Modified последнего ответа каждой ленты: {url: {...}} — для conditional GET."""
+    try:
+        with open(FEED_CACHE_FILE, "rb") as f:
+            cache = orjson.loads(f.read())
+        # старый формат: один набор заголовков для RSS_URL
+        if "etag" in cache or "last_modified" in cache:
+            cache = {RSS_URL: cache}
+        return cache
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log.error(f"Error loading feed_cache.json: {e}")
+        return {}
+
 
-def save_users(users):
+def save_feed_cache(cache):
     try:
         ensure_data_dir()
-        with open(USERS_FILE, "w") as f:
-            json.dump(users, f)
-        log.info(f"Saved users: {len(users)}")
+        write_json_atomic(FEED_CACHE_FILE, cache)
     except Exception as e:
-        log.error(f"Error saving users.json: {e}")
+        log.error(f"Error saving feed_cache.json: {e}")
 
 
 seen_posts = load_seen()
 users = load_users()
+_dirty_chats = set()
+_index_dirty = False
+_users_dirty_event = threading.Event()
+_users_save_lock = threading.Lock()
+user_index = rebuild_index(users)
+feed_cache = load_feed_cache()
+# ETag / Last-Modified ответов текущего цикла: в feed_cache переносим, только
+# когда check_rss разобрал ленты до конца
+_feed_cache_staged = {}
+# Ленты, полностью обработанные с момента старта. Первый запрос к ленте после
+# старта идёт без условий: ленту перечитываем целиком, уже разосланное отсеет seen
+_feeds_processed = set()
 
 # -----------------------------
 # HELPERS (Reddit / HTML)
 # -----------------------------
 
 
-def fetch_feed(url: str):
-    """RSS через requests + нормальный UA."""
+# Одна сессия на весь процесс: keep-alive до old.reddit.com между циклами
+http_session = requests.Session()
+http_session.headers.update({
+    "User-Agent": "WatchExchangeTelegramBot/0.1 (by u/Vast_Requirement8134)"
+})
+# временные 5xx Reddit повторяем с паузой 0.5, 1, 2 с вместо пропуска цикла
+http_session.mount("https://", HTTPAdapter(
+    pool_connections=2,
+    pool_maxsize=RSS_FETCH_WORKERS,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        raise_on_status=False,
+    ),
+))
+
+
+# blake2b записей последнего разобранного ответа каждой ленты: Reddit часто отдаёт 200 без ETag
+_feed_body_hash = {}
+
+# monotonic-время, раньше которого Reddit просил не приходить (429 + Retry-After)
+rss_backoff_until = 0.0
+
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+
+# Только те поля entry, которые нужны боту
+FeedEntry = namedtuple("FeedEntry", ["id", "link", "author", "title", "summary"])
+
+
+def _entry_from_element(elem) -> FeedEntry:
+    link_el = elem.find(ATOM_NS + "link")
+    return FeedEntry(
+        id=elem.findtext(ATOM_NS + "id", ""),
+        link=link_el.get("href", "") if link_el is not None else "",
+        author=elem.findtext(f"{ATOM_NS}author/{ATOM_NS}name", ""),
+        title=elem.findtext(ATOM_NS + "title", "").strip(),
+        summary=elem.findtext(ATOM_NS + "content", ""),
+    )
+
+
+def parse_feed(content: bytes):
+    """
+    Потоковый разбор Atom-ленты Reddit (iterparse): каждую <entry>
+    превращаем в FeedEntry и сразу очищаем, без полного дерева.
+    """
+    entries = []
     try:
-        if not url:
-            log.error("RSS_URL is empty!")
-            return feedparser.parse("")
+        for _, elem in ET.iterparse(io.BytesIO(content), events=("end",)):
+            if elem.tag == ATOM_NS + "entry":
+                entries.append(_entry_from_element(elem))
+                elem.clear()
+    except ET.ParseError as e:
+        log.warning(f"RSS parse error after {len(entries)} entries: {e}")
+    return entries
 
-        headers = {
-            "User-Agent": "WatchExchangeTelegramBot/0.1 (by u/Vast_Requirement8134)"
-        }
-        resp = requests.get(url, headers=headers, timeout=10)
-        log.info(f"RSS HTTP status={resp.status_code}, length={len(resp.text)}")
+
+# Лента не скачалась (ошибка сети/HTTP, 429) — в отличие от None (не менялась)
+FEED_FAILED = object()
+
+
+def fetch_feed(url: str):
+    """
+    RSS через requests + нормальный UA, возвращает список FeedEntry.
+    Conditional GET: если лента не менялась (304), возвращаем None.
+    Ошибка или 429 — FEED_FAILED.
+    Новые ETag / Last-Modified и хеш откладываем в _feed_cache_staged до commit_feed_cache.
+    """
+    global rss_backoff_until
+
+    try:
+        cached = feed_cache.get(url, {})
+        headers = {}
+        if url in _feeds_processed:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        resp = http_session.get(url, headers=headers, timeout=10)
+        log.info(f"RSS {url} HTTP status={resp.status_code}, length={len(resp.content)}")
+        if resp.status_code == 304:
+            return None
+        if resp.status_code == 429:
+            retry_after = resp.headers.get("Retry-After", "")
+            delay = int(retry_after) if retry_after.isdigit() else CHECK_INTERVAL_RSS
+            rss_backoff_until = max(rss_backoff_until, time.monotonic() + delay)
+            log.warning(f"RSS {url} rate limited, backing off for {delay}s")
+            return FEED_FAILED
         resp.raise_for_status()
 
-        feed = feedparser.parse(resp.text)
-        if getattr(feed, "bozo", 0):
-            log.warning(
-                f"Feedparser bozo={feed.bozo}, exception={getattr(feed, 'bozo_exception', None)}"
-            )
-        return feed
+        # те же записи, что в прошлый раз, — не разбираем XML, как при 304.
+        # Хешируем с первой <entry>: <updated> в шапке ленты меняется на каждый запрос
+        body = resp.content
+        entries_start = body.find(b"<entry")
+        digest = hashlib.blake2b(
+            body[entries_start:] if entries_start >= 0 else body, digest_size=16
+        ).digest()
+        if _feed_body_hash.get(url) == digest:
+            return None
+
+        entries = parse_feed(body)
+        # потоки пишут каждый в свой ключ
+        _feed_cache_staged[url] = {
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "digest": digest,
+        }
+        return entries
     except Exception as e:
-        log.error(f"Error fetching RSS: {e}")
-        return feedparser.parse("")
+        log.error(f"Error fetching RSS {url}: {e}")
+        return FEED_FAILED
+
+
+def fetch_feeds(urls):
+    """
+    Качаем все ленты параллельно. Возвращает (entries, failed):
+    entries — общий список FeedEntry или None, если ни одна лента не менялась;
+    failed — хотя бы одна лента не скачалась.
+    """
+    if not urls:
+        # пустой список уже залогирован при старте
+        return [], False
+
+    if len(urls) == 1:
+        results = [fetch_feed(urls[0])]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=min(RSS_FETCH_WORKERS, len(urls)),
+            thread_name_prefix="rss",
+        ) as pool:
+            results = list(pool.map(fetch_feed, urls))
+
+    failed = any(r is FEED_FAILED for r in results)
+    changed = [r for r in results if r is not None and r is not FEED_FAILED]
+    if not changed:
+        return None, failed
+    return [entry for r in changed for entry in r], failed
+
+
+def commit_feed_cache():
+    """Ленты разобраны до конца — запоминаем их ETag / Last-Modified и хеш записей."""
+    if not _feed_cache_staged:
+        return
+    for url, staged in _feed_cache_staged.items():
+        feed_cache[url] = {"etag": staged["etag"], "last_modified": staged["last_modified"]}
+        _feed_body_hash[url] = staged["digest"]
+        _feeds_processed.add(url)
+    _feed_cache_staged.clear()
+    save_feed_cache(feed_cache)
+
+
+_IMG_SRC_RE = re.compile(r"""<img[^>]+src=["']([^"']+)""", re.IGNORECASE)
 
 
 def extract_first_image_from_html(html: str):
     """Берём первую <img> из HTML summary RSS (маленький превьюшный thumbnail)."""
-    soup = BeautifulSoup(html, "html.parser")
-    img = soup.find("img")
-    if img and img.get("src"):
-        src = img["src"].replace("&amp;", "&")
-        if src.startswith("//"):
-            src = "https:" + src
-        return src
-    return None
-
-
-def extract_post_id(link: str) -> str:
-    """ID поста из URL /comments/<id>/."""
+    m = _IMG_SRC_RE.search(html or "")
+    if not m:
+        return None
+    src = m.group(1).replace("&amp;", "&")
+    if src.startswith("//"):
+        src = "https:" + src
+    return src
+
+
+_POST_ID_RE = re.compile(r"/comments/([a-z0-9]+)/")
+_AUTHOR_RE = re.compile(r"u/([A-Za-z0-9_-]+)")
+
+
+def extract_post_id(entry: FeedEntry) -> str:
+    """ID поста: из <id> вида t3_<id>, иначе из URL /comments/<id>/."""
+    if entry.id.startswith("t3_"):
+        return entry.id[3:]
+    link = entry.link
     if not link:
         return ""
-    match = re.search(r"/comments/([a-z0-9]+)/", link)
+    match = _POST_ID_RE.search(link)
     if match:
         return match.group(1)
     return link.strip()
 
 
+# авторы повторяются из цикла в цикл — регулярку гоняем один раз на имя
+@lru_cache(maxsize=1024)
 def normalize_author(raw_author: str) -> str:
     """Приводим автора к 'vast_requirement8134' формату."""
     if not raw_author:
@@ -178,7 +644,7 @@ def normalize_author(raw_author: str) -> str:
 
     a = raw_author.strip()
 
-    m = re.search(r"u/([A-Za-z0-9_-]+)", a)
+    m = _AUTHOR_RE.search(a)
     if m:
         return m.group(1).lower()
 
@@ -189,27 +655,21 @@ def normalize_author(raw_author: str) -> str:
 
 
 def escape_html(text: str) -> str:
-    """На всякий случай, если захочешь HTML где-то ещё."""
+    """Экранирование для сообщений с parse_mode=HTML."""
     if not text:
         return ""
-    return (
-        text.replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-    )
+    return html.escape(text, quote=False)
+
+
+# Разделитель списка вместе с окружающими пробелами и кавычками
+_SPLIT_RE = re.compile(r"[\s'\"]*[,;][\s'\"]*")
 
 
 def parse_csv_list(s: str):
     """
     Превращаем строку 'seiko, omega; tudor' -> ['seiko', 'omega', 'tudor']
     """
-    parts = s.replace(";", ",").split(",")
-    result = []
-    for p in parts:
-        x = p.strip().strip(" '\"")
-        if x:
-            result.append(x)
-    return result
+    return [t for t in _SPLIT_RE.split(s.strip().strip(" '\"")) if t]
 
 
 # -----------------------------
@@ -219,241 +679,264 @@ def parse_csv_list(s: str):
 last_update_id = None
 
 
-def handle_text_message(chat_id: int, text: str):
-    """
-    Обработка текстовых сообщений:
-    - команды: /start, /help, /settings, /keywords, /authors, /pause, /resume
-    """
-    global users
-    chat_id_str = str(chat_id)
-    text = text.strip()
+def new_user_cfg():
+    """Настройки нового пользователя: фильтры пустые, алерты включены."""
+    return {
+        "keywords": [],
+        "tracked_users": [],
+        "paused": False,
+        "sent": SeenSet(maxlen=MAX_SENT_PER_USER),
+    }
 
-    # гарантируем, что user-структура есть
-    if chat_id_str not in users:
-        users[chat_id_str] = {
-            "keywords": [],
-            "tracked_users": [],
-            "paused": False,
-        }
 
-    user_cfg = users[chat_id_str]
+# Тексты /start и /help не зависят от пользователя (кроме статуса паузы) —
+# собираем один раз при импорте
+_WELCOME_TEMPLATE = (
+    "==============================\n"
+    "🔍 HOW FILTERS WORK\n"
+    "==============================\n\n"
+    "You will receive a post if ANY of the following is true:\n"
+    "1) The author is in your tracked authors list\n"
+    "2) The title contains one of your keywords\n\n"
+    "These filters work independently (logical OR):\n"
+    "- Only authors set → you get all posts from them\n"
+    "- Only keywords set → you get all posts containing them\n"
+    "- Both set → you get everything matching either filter\n"
+    "- Both empty → you receive nothing\n\n"
+    "==============================\n"
+    "⚙️ SETTING YOUR FILTERS\n"
+    "==============================\n\n"
+    "Set or replace keywords:\n"
+    "/keywords seiko, omega, tudor\n\n"
+    "Clear all keywords:\n"
+    "/keywords clear\n\n"
+    "Set tracked authors:\n"
+    "/authors WatchTrader247, DealsAreLife, TimepieceWizard\n\n"
+    "Clear tracked authors:\n"
+    "/authors clear\n\n"
+    "View your current settings:\n"
+    "/settings\n\n"
+    "Pause / resume alerts:\n"
+    "/pause  /resume\n\n"
+    "Current alert status: {status}\n\n"
+    "Use /help for more details.\n"
+)
+WELCOME_MESSAGES = {
+    False: _WELCOME_TEMPLATE.format(status="active"),
+    True: _WELCOME_TEMPLATE.format(status="paused"),
+}
+
+# Расписание проверок для /help: пока новых постов нет, интервал растёт до RSS_MAX_INTERVAL
+_check_min = max(1, round(CHECK_INTERVAL_RSS / 60))
+_max_check_min = max(1, round(RSS_MAX_INTERVAL / 60))
+_CHECK_SCHEDULE = f"every {_check_min} min"
+if _max_check_min > _check_min:
+    _CHECK_SCHEDULE += f"; when no new posts appear it slows down to every {_max_check_min} min"
+
+HELP_MESSAGE = (
+    "==============================\n"
+    "📘 HELP\n"
+    "==============================\n\n"
+    "This bot sends you alerts about new Reddit posts based on two filters:\n"
+    "- tracked authors\n"
+    "- keywords in the title\n\n"
+    "You receive a post if it matches EITHER filter.\n\n"
+    "==============================\n"
+    "⚙️ AVAILABLE COMMANDS\n"
+    "==============================\n\n"
+    "/start\n"
+    "  Show the introduction and basic setup info.\n\n"
+    "/settings\n"
+    "  Display your current keywords, tracked authors and pause status.\n\n"
+    "/keywords word1, word2, word3\n"
+    "  Replace your keyword list in one step.\n"
+    "  Example: /keywords seiko, omega, grand seiko\n\n"
+    "/keywords clear\n"
+    "  Remove all keywords.\n\n"
+    "/keywords\n"
+    "  Without arguments: show your current keywords and\n"
+    "  a short hint on how to set them.\n\n"
+    "/authors name1, name2\n"
+    "  Replace your tracked authors list in one step.\n"
+    "  Example: /authors WatchTrader247, DealsAreLife\n\n"
+    "/authors clear\n"
+    "  Remove all tracked authors.\n\n"
+    "/authors\n"
+    "  Without arguments: show your current tracked authors and\n"
+    "  a short hint on how to set them.\n\n"
+    "/pause\n"
+    "  Temporarily stop receiving alerts (your filters are preserved).\n\n"
+    "/resume\n"
+    "  Resume alerts using your current filters.\n\n"
+    "==============================\n"
+    "💡 TIPS\n"
+    "==============================\n\n"
+    "- Keywords are case-insensitive.\n"
+    "- You can use only keywords, only authors, or both.\n"
+    "- If you receive no alerts, check your /settings.\n"
+    "- Use /pause if you need a break, /resume to continue.\n"
+    f"- The bot checks Reddit {_CHECK_SCHEDULE}.\n\n"
+    "==============================\n"
+    "Need help? Just send /start or /help again.\n"
+)
 
-    # ----- /start -----
-    if text.startswith("/start"):
-        user_cfg.setdefault("keywords", [])
-        user_cfg.setdefault("tracked_users", [])
-        user_cfg.setdefault("paused", False)
-        save_users(users)
-
-        paused_text = "paused" if user_cfg.get("paused") else "active"
-
-        welcome_message = (
-            "==============================\n"
-            "🔍 HOW FILTERS WORK\n"
-            "==============================\n\n"
-            "You will receive a post if ANY of the following is true:\n"
-            "1) The author is in your tracked authors list\n"
-            "2) The title contains one of your keywords\n\n"
-            "These filters work independently (logical OR):\n"
-            "- Only authors set → you get all posts from them\n"
-            "- Only keywords set → you get all posts containing them\n"
-            "- Both set → you get everything matching either filter\n"
-            "- Both empty → you receive nothing\n\n"
-            "==============================\n"
-            "⚙️ SETTING YOUR FILTERS\n"
-            "==============================\n\n"
-            "Set or replace keywords:\n"
-            "/keywords seiko, omega, tudor\n\n"
-            "Clear all keywords:\n"
-            "/keywords clear\n\n"
-            "Set tracked authors:\n"
-            "/authors WatchTrader247, DealsAreLife, TimepieceWizard\n\n"
-            "Clear tracked authors:\n"
-            "/authors clear\n\n"
-            "View your current settings:\n"
-            "/settings\n\n"
-            "Pause / resume alerts:\n"
-            "/pause  /resume\n\n"
-            f"Current alert status: {paused_text}\n\n"
-            "Use /help for more details.\n"
-        )
 
+def _on_start(chat_id: int, user_cfg: dict, rest: str):
+    bot.send_message(
+        chat_id=chat_id,
+        text=WELCOME_MESSAGES[bool(user_cfg.get("paused"))]
+    )
+
+
+def _on_help(chat_id: int, user_cfg: dict, rest: str):
+    bot.send_message(chat_id=chat_id, text=HELP_MESSAGE)
+
+
+def _on_settings(chat_id: int, user_cfg: dict, rest: str):
+    kw = ", ".join(user_cfg.get("keywords", [])) or "none"
+    au = ", ".join(user_cfg.get("tracked_users", [])) or "none"
+    paused = user_cfg.get("paused", False)
+    status = "paused" if paused else "active"
+    msg = (
+        "📋 Your current settings:\n\n"
+        f"Keywords: {kw}\n"
+        f"Tracked authors: {au}\n"
+        f"Alerts status: {status}\n\n"
+        "Use /keywords and /authors to modify filters.\n"
+        "Use /pause or /resume to control alerts.\n"
+        "Type /help to see full instructions."
+    )
+    bot.send_message(chat_id=chat_id, text=msg)
+
+
+def _on_pause(chat_id: int, user_cfg: dict, rest: str):
+    user_cfg["paused"] = True
+    mark_users_dirty(str(chat_id))
+    bot.send_message(
+        chat_id=chat_id,
+        text="⏸ Alerts paused. You will not receive new post notifications until you use /resume."
+    )
+
+
+def _on_resume(chat_id: int, user_cfg: dict, rest: str):
+    user_cfg["paused"] = False
+    mark_users_dirty(str(chat_id))
+    bot.send_message(
+        chat_id=chat_id,
+        text="▶ Alerts resumed. You will receive notifications based on your current filters."
+    )
+
+
+def _on_keywords(chat_id: int, user_cfg: dict, rest: str):
+    # /keywords clear
+    if rest.lower() == "clear":
+        user_cfg["keywords"] = []
+        mark_users_dirty(str(chat_id))
         bot.send_message(
             chat_id=chat_id,
-            text=welcome_message
+            text="🗑️ All keywords removed."
         )
         return
 
-    # ----- /help -----
-    if text.startswith("/help"):
-        help_message = (
-            "==============================\n"
-            "📘 HELP\n"
-            "==============================\n\n"
-            "This bot sends you alerts about new Reddit posts based on two filters:\n"
-            "- tracked authors\n"
-            "- keywords in the title\n\n"
-            "You receive a post if it matches EITHER filter.\n\n"
-            "==============================\n"
-            "⚙️ AVAILABLE COMMANDS\n"
-            "==============================\n\n"
-            "/start\n"
-            "  Show the introduction and basic setup info.\n\n"
-            "/settings\n"
-            "  Display your current keywords, tracked authors and pause status.\n\n"
-            "/keywords word1, word2, word3\n"
-            "  Replace your keyword list in one step.\n"
-            "  Example: /keywords seiko, omega, grand seiko\n\n"
-            "/keywords clear\n"
-            "  Remove all keywords.\n\n"
-            "/keywords\n"
-            "  Without arguments: show your current keywords and\n"
-            "  a short hint on how to set them.\n\n"
-            "/authors name1, name2\n"
-            "  Replace your tracked authors list in one step.\n"
-            "  Example: /authors WatchTrader247, DealsAreLife\n\n"
-            "/authors clear\n"
-            "  Remove all tracked authors.\n\n"
-            "/authors\n"
-            "  Without arguments: show your current tracked authors and\n"
-            "  a short hint on how to set them.\n\n"
-            "/pause\n"
-            "  Temporarily stop receiving alerts (your filters are preserved).\n\n"
-            "/resume\n"
-            "  Resume alerts using your current filters.\n\n"
-            "==============================\n"
-            "💡 TIPS\n"
-            "==============================\n\n"
-            "- Keywords are case-insensitive.\n"
-            "- You can use only keywords, only authors, or both.\n"
-            "- If you receive no alerts, check your /settings.\n"
-            "- Use /pause if you need a break, /resume to continue.\n"
-            "- The bot checks Reddit every 1–2 minutes.\n\n"
-            "==============================\n"
-            "Need help? Just send /start or /help again.\n"
-        )
-
-        bot.send_message(chat_id=chat_id, text=help_message)
-        save_users(users)
-        return
-
-    # ----- /settings -----
-    if text.startswith("/settings"):
-        kw = ", ".join(user_cfg.get("keywords", [])) or "none"
-        au = ", ".join(user_cfg.get("tracked_users", [])) or "none"
-        paused = user_cfg.get("paused", False)
-        status = "paused" if paused else "active"
+    # /keywords без аргументов → показать текущие + usage
+    if not rest:
+        current = ", ".join(user_cfg.get("keywords", [])) or "none"
         msg = (
-            "📋 Your current settings:\n\n"
-            f"Keywords: {kw}\n"
-            f"Tracked authors: {au}\n"
-            f"Alerts status: {status}\n\n"
-            "Use /keywords and /authors to modify filters.\n"
-            "Use /pause or /resume to control alerts.\n"
-            "Type /help to see full instructions."
+            "🔑 Current keywords:\n"
+            f"{current}\n\n"
+            "To set or replace your keywords, use:\n"
+            "/keywords word1, word2, word3\n\n"
+            "Example:\n"
+            "/keywords seiko, omega, grand seiko\n\n"
+            "To remove all keywords:\n"
+            "/keywords clear"
         )
         bot.send_message(chat_id=chat_id, text=msg)
-        save_users(users)
         return
 
-    # ----- /pause -----
-    if text.startswith("/pause"):
-        user_cfg["paused"] = True
-        save_users(users)
+    # /keywords с аргументами → сразу сохраним
+    kws = [k.lower() for k in parse_csv_list(rest)]
+    user_cfg["keywords"] = kws
+    mark_users_dirty(str(chat_id))
+    bot.send_message(
+        chat_id=chat_id,
+        text=f"✅ Keywords updated: {', '.join(kws) if kws else 'none'}"
+    )
+
+
+def _on_authors(chat_id: int, user_cfg: dict, rest: str):
+    # /authors clear
+    if rest.lower() == "clear":
+        user_cfg["tracked_users"] = []
+        mark_users_dirty(str(chat_id))
         bot.send_message(
             chat_id=chat_id,
-            text="⏸ Alerts paused. You will not receive new post notifications until you use /resume."
+            text="🗑️ All tracked authors removed."
         )
         return
 
-    # ----- /resume -----
-    if text.startswith("/resume"):
-        user_cfg["paused"] = False
-        save_users(users)
-        bot.send_message(
-            chat_id=chat_id,
-            text="▶ Alerts resumed. You will receive notifications based on your current filters."
+    # /authors без аргументов → показать текущие + usage
+    if not rest:
+        current = ", ".join(user_cfg.get("tracked_users", [])) or "none"
+        msg = (
+            "👤 Current tracked authors:\n"
+            f"{current}\n\n"
+            "To set or replace your tracked authors, use:\n"
+            "/authors name1, name2\n\n"
+            "Example:\n"
+            "/authors WatchTrader247, DealsAreLife\n\n"
+            "To remove all tracked authors:\n"
+            "/authors clear"
         )
+        bot.send_message(chat_id=chat_id, text=msg)
         return
 
-    # ----- /keywords -----
-    if text.startswith("/keywords"):
-        rest = text[len("/keywords"):].strip()
-
-        # /keywords clear
-        if rest.lower() == "clear":
-            user_cfg["keywords"] = []
-            save_users(users)
-            bot.send_message(
-                chat_id=chat_id,
-                text="🗑️ All keywords removed."
-            )
-            return
+    # /authors с аргументами
+    auths = [u.lower() for u in parse_csv_list(rest)]
+    user_cfg["tracked_users"] = auths
+    mark_users_dirty(str(chat_id))
+    bot.send_message(
+        chat_id=chat_id,
+        text=f"✅ Tracked authors updated: {', '.join(auths) if auths else 'none'}"
+    )
 
-        # /keywords без аргументов → показать текущие + usage
-        if not rest:
-            current = ", ".join(user_cfg.get("keywords", [])) or "none"
-            msg = (
-                "🔑 Current keywords:\n"
-                f"{current}\n\n"
-                "To set or replace your keywords, use:\n"
-                "/keywords word1, word2, word3\n\n"
-                "Example:\n"
-                "/keywords seiko, omega, grand seiko\n\n"
-                "To remove all keywords:\n"
-                "/keywords clear"
-            )
-            bot.send_message(chat_id=chat_id, text=msg)
-            return
 
-        # /keywords с аргументами → сразу сохраним
-        kws = [k.lower() for k in parse_csv_list(rest)]
-        user_cfg["keywords"] = kws
-        save_users(users)
-        bot.send_message(
-            chat_id=chat_id,
-            text=f"✅ Keywords updated: {', '.join(kws) if kws else 'none'}"
-        )
-        return
+# команда -> обработчик(chat_id, user_cfg, аргументы)
+COMMAND_HANDLERS = {
+    "/start": _on_start,
+    "/help": _on_help,
+    "/settings": _on_settings,
+    "/pause": _on_pause,
+    "/resume": _on_resume,
+    "/keywords": _on_keywords,
+    "/authors": _on_authors,
+}
 
-    # ----- /authors -----
-    if text.startswith("/authors"):
-        rest = text[len("/authors"):].strip()
-
-        # /authors clear
-        if rest.lower() == "clear":
-            user_cfg["tracked_users"] = []
-            save_users(users)
-            bot.send_message(
-                chat_id=chat_id,
-                text="🗑️ All tracked authors removed."
-            )
-            return
 
-        # /authors без аргументов → показать текущие + usage
-        if not rest:
-            current = ", ".join(user_cfg.get("tracked_users", [])) or "none"
-            msg = (
-                "👤 Current tracked authors:\n"
-                f"{current}\n\n"
-                "To set or replace your tracked authors, use:\n"
-                "/authors name1, name2\n\n"
-                "Example:\n"
-                "/authors WatchTrader247, DealsAreLife\n\n"
-                "To remove all tracked authors:\n"
-                "/authors clear"
-            )
-            bot.send_message(chat_id=chat_id, text=msg)
-            return
+def handle_text_message(chat_id: int, text: str):
+    """
+    Обработка текстовых сообщений:
+    - команды: /start, /help, /settings, /keywords, /authors, /pause, /resume
+    """
+    global users
+    chat_id_str = str(chat_id)
 
-        # /authors с аргументами
-        auths = [u.lower() for u in parse_csv_list(rest)]
-        user_cfg["tracked_users"] = auths
-        save_users(users)
-        bot.send_message(
-            chat_id=chat_id,
-            text=f"✅ Tracked authors updated: {', '.join(auths) if auths else 'none'}"
-        )
+    # гарантируем, что user-структура есть
+    # (load_users уже нормализует ключи у существующих пользователей)
+    if chat_id_str not in users:
+        users[chat_id_str] = new_user_cfg()
+        mark_users_dirty(chat_id_str)
+
+    user_cfg = users[chat_id_str]
+
+    # "/keywords@WatchBot seiko, omega" -> "/keywords", "seiko, omega"
+    parts = text.split(None, 1)
+    command = parts[0].split("@", 1)[0] if parts else ""
+    rest = parts[1].strip() if len(parts) > 1 else ""
+
+    handler = COMMAND_HANDLERS.get(command)
+    if handler is not None:
+        handler(chat_id, user_cfg, rest)
         return
 
     # ----- всё остальное -----
@@ -463,11 +946,26 @@ def handle_text_message(chat_id: int, text: str):
     )
 
 
+# Бот читает только текстовые сообщения — остальные типы апдейтов не запрашиваем
+ALLOWED_UPDATES = ["message"]
+
+
+def process_update(upd):
+    if upd.message and upd.message.text:
+        chat_id = upd.message.chat.id
+        text = upd.message.text
+        log.info(f"Got Telegram message from {chat_id}: {text}")
+        handle_text_message(chat_id, text)
+
+
 def poll_telegram_updates():
     """
-    Периодически опрашиваем Telegram, чтобы:
+    Один long-poll запрос к Telegram, чтобы:
     - регистрировать новых пользователей (/start)
     - обновлять их настройки (/keywords, /authors, /pause, /resume)
+
+    get_updates висит до TELEGRAM_LONG_POLL_TIMEOUT секунд и возвращается
+    сразу, как только приходит сообщение.
     """
     global last_update_id
 
@@ -476,118 +974,434 @@ def poll_telegram_updates():
         if last_update_id is not None:
             kwargs["offset"] = last_update_id + 1
 
-        updates = bot.get_updates(timeout=5, **kwargs)
+        updates = bot.get_updates(
+            timeout=TELEGRAM_LONG_POLL_TIMEOUT,
+            allowed_updates=ALLOWED_UPDATES,
+            **kwargs,
+        )
 
         for upd in updates:
             last_update_id = upd.update_id
-            if upd.message and upd.message.text:
-                chat_id = upd.message.chat.id
-                text = upd.message.text
-                log.info(f"Got Telegram message from {chat_id}: {text}")
-                handle_text_message(chat_id, text)
+            process_update(upd)
     except Exception as e:
         log.error(f"Error polling Telegram updates: {e}")
+        # не долбим API в цикле, если Telegram недоступен
+        time.sleep(TELEGRAM_POLL_INTERVAL)
+
+
+def telegram_loop():
+    """Отдельный поток: long polling без пауз между запросами."""
+    try:
+        # если раньше стоял вебхук, getUpdates вернёт Conflict
+        bot.delete_webhook()
+    except Exception as e:
+        log.error(f"Error deleting webhook: {e}")
+    while True:
+        poll_telegram_updates()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Принимает апдейты, которые Telegram присылает POST-ом на WEBHOOK_PATH."""
+
+    def do_POST(self):
+        if self.path != WEBHOOK_PATH:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            upd = Update.de_json(orjson.loads(self.rfile.read(length)), bot)
+            if upd is not None:
+                process_update(upd)
+        except Exception as e:
+            log.error(f"Error handling webhook update: {e}")
+
+        # всегда 200, иначе Telegram будет повторять тот же апдейт
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        # путь содержит секрет — не пишем access log
+        pass
+
+
+def webhook_loop():
+    """
+    Отдельный поток: HTTP-сервер для вебхука. Однопоточный HTTPServer
+    обрабатывает апдейты по одному, как и long polling.
+    """
+    server = HTTPServer(("", WEBHOOK_PORT), WebhookHandler)
+    try:
+        bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH, allowed_updates=ALLOWED_UPDATES
+        )
+        log.info(f"Webhook set, listening on port {WEBHOOK_PORT}")
+    except Exception as e:
+        log.error(f"Error setting webhook: {e}")
+    server.serve_forever()
 
 
 # -----------------------------
-# MAIN LOOP
+# RSS
 # -----------------------------
-log.info("Multi-user WatchExchange bot started (RSS mode)!")
 
-last_rss_check = 0
 
-while True:
-    now = time.time()
+# Telegram: не больше 10 элементов в media group и 4096 символов в сообщении
+MEDIA_GROUP_LIMIT = 10
+TEXT_BATCH_LIMIT = 4000
+TEXT_BATCH_SEPARATOR = "\n\n──\n\n"
+
+# Очередь исходящих пачек: RSS только кладёт, отправляют воркеры (SEND_WORKERS — в CONFIG)
+SEND_RETRIES = 3
+outbox = queue.Queue(maxsize=1024)
+
+# Глобальный лимит Telegram ~30 сообщений/с, держимся чуть ниже
+TELEGRAM_SEND_RATE = 25
+# В один чат — не чаще раза в секунду
+TELEGRAM_CHAT_RATE = 1
+
+
+class RateLimiter:
+    """Не больше rate вызовов в секунду на все потоки (равномерно по времени)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
-    # 1) быстро обрабатываем команды/сообщения
-    poll_telegram_updates()
 
-    # 2) раз в CHECK_INTERVAL_RSS дергаем Reddit
-    if now - last_rss_check >= CHECK_INTERVAL_RSS:
+send_limiter = RateLimiter(TELEGRAM_SEND_RATE)
+
+_chat_limiters = {}
+_chat_limiters_lock = threading.Lock()
+
+
+def chat_limiter(chat_id: int) -> RateLimiter:
+    """Свой RateLimiter на каждый чат: пачки одного чата могут уйти из разных потоков."""
+    with _chat_limiters_lock:
+        limiter = _chat_limiters.get(chat_id)
+        if limiter is None:
+            limiter = _chat_limiters[chat_id] = RateLimiter(TELEGRAM_CHAT_RATE)
+        return limiter
+
+
+def call_telegram(method, **kwargs):
+    """
+    Вызов Bot API с повторами:
+    - RetryAfter (flood wait) — ждём столько, сколько просит Telegram
+    - сетевые ошибки — экспоненциальная пауза 1, 2, 4... секунд
+    Перед каждой попыткой ждём и лимит чата, и общий лимит бота.
+    """
+    per_chat = chat_limiter(kwargs["chat_id"])
+    for attempt in range(SEND_RETRIES):
+        per_chat.wait()
+        send_limiter.wait()
+        try:
+            return method(**kwargs)
+        except RetryAfter as e:
+            delay = e.retry_after
+            log.warning(f"Flood wait {delay}s on {method.__name__}")
+        except BadRequest:
+            # битый запрос повтор не исправит
+            raise
+        except NetworkError as e:
+            delay = 2 ** attempt
+            log.warning(f"Network error on {method.__name__}: {e}, retry in {delay}s")
+        time.sleep(delay)
+    per_chat.wait()
+    send_limiter.wait()
+    return method(**kwargs)
+
+
+def send_batch(chat_id: int, items):
+    """
+    Отправляет пачку постов одному пользователю за минимум запросов:
+    - посты с картинкой → sendMediaGroup по 10 штук (одиночный → sendPhoto)
+    - посты без картинки → склеиваем в сообщения до TEXT_BATCH_LIMIT символов
+    items: список (post_id, message, image_url)
+    """
+    photos = [item for item in items if item[2]]
+    texts = [item for item in items if not item[2]]
+
+    for i in range(0, len(photos), MEDIA_GROUP_LIMIT):
+        chunk = photos[i:i + MEDIA_GROUP_LIMIT]
+        try:
+            if len(chunk) == 1:
+                _, msg, url = chunk[0]
+                call_telegram(
+                    bot.send_photo, chat_id=chat_id, photo=url, caption=msg, parse_mode=ParseMode.HTML
+                )
+            else:
+                media = [InputMediaPhoto(media=url, caption=msg, parse_mode=ParseMode.HTML) for _, msg, url in chunk]
+                call_telegram(bot.send_media_group, chat_id=chat_id, media=media)
+        except Exception as e:
+            # одна битая картинка валит всю группу — досылаем текстом
+            log.error(f"Error sending photos to {chat_id}: {e}")
+            texts.extend(chunk)
+        else:
+            mark_sent(chat_id, chunk)
+
+    batch = []
+    batch_len = 0
+    for item in texts:
+        msg_len = len(item[1])
+        if batch and batch_len + len(TEXT_BATCH_SEPARATOR) + msg_len > TEXT_BATCH_LIMIT:
+            _send_text(chat_id, batch)
+            batch = []
+            batch_len = 0
+        batch_len += msg_len + (len(TEXT_BATCH_SEPARATOR) if batch else 0)
+        batch.append(item)
+    if batch:
+        _send_text(chat_id, batch)
+
+    log.info(f"Sent {len(items)} posts to {chat_id}")
+
+
+def _send_text(chat_id: int, items):
+    text = TEXT_BATCH_SEPARATOR.join(msg for _, msg, _ in items)
+    try:
+        call_telegram(bot.send_message, chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
+    except Exception as e:
+        log.error(f"Error sending message to {chat_id}: {e}")
+    else:
+        mark_sent(chat_id, items)
+
+
+def mark_sent(chat_id: int, items):
+    """Запоминаем доставленные посты, чтобы не слать их повторно после рестарта."""
+    cfg = users.get(str(chat_id))
+    if cfg is None:
+        return
+    for post_id, _, _ in items:
+        cfg["sent"].add(post_id)
+    mark_users_dirty(str(chat_id), reindex=False)
+
+
+def send_worker():
+    """Поток-отправщик: медленный Telegram не тормозит разбор RSS."""
+    while True:
+        chat_id, items = outbox.get()
         try:
-            feed = fetch_feed(RSS_URL)
-            log.info(f"Fetched feed with {len(feed.entries)} entries")
+            send_batch(chat_id, items)
+        except Exception as e:
+            log.error(f"Error in send worker for {chat_id}: {e}")
+        finally:
+            # и при ошибке: Telegram уже отказал после повторов, бесконечно не шлём
+            release_pending([post_id for post_id, _, _ in items])
+            outbox.task_done()
+
+
+# Хвост уведомления после "🕵️ New post (<источник>)", parse_mode=HTML
+POST_MESSAGE_TAIL = (
+    "\n\n"
+    "Author: {author}\n\n"
+    "<b>{title}</b>\n"
+    "{link}"
+)
 
-            for entry in feed.entries:
-                link = getattr(entry, "link", "") or ""
-                post_id = extract_post_id(link)
 
-                raw_author = entry.get("author", "") or ""
-                author_norm = normalize_author(raw_author)
+# Заголовки для постоянных источников: в них нет HTML-спецсимволов, экранировать нечего
+MESSAGE_HEAD_AUTHOR_AND_KEYWORD = "🕵️ New post (tracked author + keyword match)"
+MESSAGE_HEAD_AUTHOR = "🕵️ New post (tracked author)"
 
-                title = getattr(entry, "title", "") or ""
-                title_lower = title.lower()
-                summary = entry.summary
 
-                # если пост уже видели — пропускаем для всех
-                if post_id in seen_posts:
+def check_rss():
+    """
+    Один проход по RSS: рассылаем новые посты подходящим пользователям.
+    Возвращает число новых постов (0 — лента не менялась), None — если новых нет,
+    а хотя бы одну ленту не удалось скачать или разобрать.
+    """
+    # заголовки от прохода, который упал посередине, не применяем
+    _feed_cache_staged.clear()
+    new_post_ids = []
+    # chat_id -> [(post_id, message, image_url)], шлём пачкой после разбора ленты
+    batches = {}
+    try:
+        entries, failed = fetch_feeds(RSS_URLS)
+        if entries is None:
+            if failed:
+                return None
+            log.info("Feed not modified, nothing to do")
+            return 0
+        log.info(f"Fetched feed with {len(entries)} entries")
+
+        for entry in entries:
+            link = entry.link
+            post_id = extract_post_id(entry)
+
+            # если пост уже видели — пропускаем для всех, ничего больше не разбирая
+            if post_id in seen_posts:
+                continue
+
+            author_norm = normalize_author(entry.author)
+
+            title = entry.title
+            title_lower = title.lower()
+
+            # картинку и общую часть сообщения готовим, только если нашёлся
+            # хотя бы один получатель — и один раз на всех
+            image_url = None
+            post_tail = None
+
+            # решаем, кому слать: один проход автомата по заголовку
+            # находит все ключевые слова сразу, без перебора пользователей
+            keyword_to_chats, author_to_chats, keyword_matcher = user_index
+            author_chats = author_to_chats.get(author_norm, ())
+            matched_by_chat = {}
+            if keyword_matcher is not None:
+                title_kws = dict.fromkeys(kw for _, kw in keyword_matcher.iter(title_lower))
+                for kw in title_kws:
+                    for chat_id in keyword_to_chats[kw]:
+                        matched_by_chat.setdefault(chat_id, []).append(kw)
+
+            for chat_id in set(author_chats) | matched_by_chat.keys():
+                # уже доставляли этому пользователю (например, до рестарта)
+                cfg = users.get(str(chat_id))
+                if cfg is not None and post_id in cfg.get("sent", ()):
                     continue
 
-                image_url = extract_first_image_from_html(summary)
+                if post_tail is None:
+                    image_url = extract_first_image_from_html(entry.summary) or ""
+                    post_tail = POST_MESSAGE_TAIL.format(
+                        author=escape_html(author_norm or "unknown"),
+                        title=escape_html(title),
+                        link=escape_html(link),
+                    )
 
-                author_html = escape_html(author_norm or "unknown")
-                title_html = escape_html(title)
+                matched = matched_by_chat.get(chat_id, [])
+                author_ok = chat_id in author_chats
+                keyword_ok = bool(matched)
+
+                if author_ok and keyword_ok:
+                    message = MESSAGE_HEAD_AUTHOR_AND_KEYWORD + post_tail
+                elif author_ok:
+                    message = MESSAGE_HEAD_AUTHOR + post_tail
+                else:
+                    # ключевые слова ввёл пользователь — экранируем
+                    source_html = escape_html(f"keyword match: {', '.join(matched)}")
+                    message = f"🕵️ New post ({source_html}){post_tail}"
+
+                batches.setdefault(chat_id, []).append((post_id, message, image_url))
+                log.info(
+                    f"Queued post {post_id} for {chat_id} "
+                    f"(author_ok={author_ok}, keyword_ok={keyword_ok})"
+                )
+
+            # в памяти — сразу, чтобы следующий цикл не поставил пост в очередь повторно
+            seen_posts.add(post_id)
+            new_post_ids.append(post_id)
+
+        # лента разобрана целиком — только теперь запоминаем её ETag и хеш, иначе
+        # после сбоя необработанные посты спрятались бы за 304
+        commit_feed_cache()
 
-                # решаем, кому слать
-                for chat_id_str, cfg in users.items():
-                    chat_id = int(chat_id_str)
-                    user_keywords = cfg.get("keywords", [])
-                    user_authors = cfg.get("tracked_users", [])
-                    paused = cfg.get("paused", False)
+    except Exception as e:
+        log.error(f"Error in RSS loop: {e}")
+        return None
+    finally:
+        # при ошибке посередине ленты уже разобранные посты всё равно отправляем:
+        # в seen_posts они попали, в следующем цикле их больше не будет.
+        # На диск пост с получателями пишет отправщик, когда уйдут все его пачки,
+        # посты без получателей — сразу, одной записью в seen.log
+        queued_ids = [post_id for items in batches.values() for post_id, _, _ in items]
+        hold_pending(queued_ids)
+        for chat_id, items in batches.items():
+            outbox.put((chat_id, items))
+        queued = set(queued_ids)
+        idle_ids = [post_id for post_id in new_post_ids if post_id not in queued]
+        if idle_ids:
+            append_seen(idle_ids)
+    if failed and not new_post_ids:
+        return None
+    return len(new_post_ids)
 
-                    # если пользователь на паузе — ничего не шлём
-                    if paused:
-                        continue
 
-                    author_ok = author_norm in user_authors
-                    keyword_ok = any(kw in title_lower for kw in user_keywords)
+# -----------------------------
+# MAIN
+# -----------------------------
 
-                    if not (author_ok or keyword_ok):
-                        continue
 
-                    if author_ok and keyword_ok:
-                        source_label = "tracked author + keyword match"
-                    elif author_ok:
-                        source_label = "tracked author"
-                    else:
-                        matched = [kw for kw in user_keywords if kw in title_lower]
-                        source_label = f"keyword match: {', '.join(matched) or 'unknown'}"
+# Сколько секунд при остановке ждём, пока уйдут сообщения из очереди
+SHUTDOWN_GRACE = 20
 
-                    source_html = escape_html(source_label)
+stop_event = threading.Event()
 
-                    message = (
-                        f"🕵️ New post ({source_html})\n\n"
-                        f"Author: {author_html}\n\n"
-                        f"{title_html}\n"
-                        f"{link}"
-                    )
 
-                    try:
-                        if image_url:
-                            bot.send_photo(
-                                chat_id=chat_id,
-                                photo=image_url,
-                                caption=message,
-                            )
-                        else:
-                            bot.send_message(
-                                chat_id=chat_id,
-                                text=message,
-                            )
-                        log.info(
-                            f"Sent post {post_id} to {chat_id} "
-                            f"(author_ok={author_ok}, keyword_ok={keyword_ok}, paused={paused})"
-                        )
-                    except Exception as e:
-                        log.error(f"Error sending message to {chat_id}: {e}")
-
-                seen_posts.add(post_id)
-                save_seen(seen_posts)
-
-            last_rss_check = now
+def handle_stop_signal(signum, frame):
+    log.info(f"Got signal {signum}, shutting down")
+    stop_event.set()
 
-        except Exception as e:
-            log.error(f"Error in RSS loop: {e}")
 
-    # 3) небольшой sleep, чтобы не жечь CPU
-    time.sleep(TELEGRAM_POLL_INTERVAL)
\ No newline at end of file
+def shutdown():
+    """Досылаем очередь и сохраняем состояние один раз перед выходом."""
+    deadline = time.monotonic() + SHUTDOWN_GRACE
+    while outbox.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if outbox.unfinished_tasks:
+        log.warning(
+            f"{outbox.unfinished_tasks} batches not sent before shutdown, "
+            "their posts will be sent after restart"
+        )
+    # недосланные посты save_seen не сохраняет
+    save_seen(seen_posts)
+    flush_users()
+    log.info("Bot stopped")
+
+
+def main():
+    log.info("Multi-user WatchExchange bot started (RSS mode)!")
+    signal.signal(signal.SIGTERM, handle_stop_signal)
+    signal.signal(signal.SIGINT, handle_stop_signal)
+
+    # 1) команды обрабатываются в своём потоке и не ждут RSS
+    threading.Thread(target=users_writer, name="users-writer", daemon=True).start()
+    updates_loop = webhook_loop if WEBHOOK_URL else telegram_loop
+    threading.Thread(target=updates_loop, name="telegram", daemon=True).start()
+    for i in range(SEND_WORKERS):
+        threading.Thread(target=send_worker, name=f"sender-{i}", daemon=True).start()
+
+    # 2) раз в CHECK_INTERVAL_RSS (+ до RSS_JITTER секунд) дергаем Reddit
+    #    (ровная сетка по monotonic, длительность самого цикла не сдвигает расписание),
+    #    seen.log сворачиваем в seen.json при старте и каждые SEEN_COMPACT_EVERY id
+    #    Пока новых постов нет, интервал удваивается (до RSS_MAX_INTERVAL),
+    #    первый же новый пост возвращает его к CHECK_INTERVAL_RSS. Ошибки не считаются.
+    save_seen(seen_posts)
+    next_tick = time.monotonic()
+    empty_streak = 0
+    while not stop_event.is_set():
+        new_posts = check_rss()
+        if new_posts:
+            empty_streak = 0
+        elif new_posts == 0:
+            empty_streak += 1
+        # None (Reddit недоступен) — интервал не трогаем: это не «тихо», а сбой,
+        # и после него хотим узнать о новых постах как можно раньше
+        if seen_log_count >= SEEN_COMPACT_EVERY:
+            save_seen(seen_posts)
+
+        interval = min(CHECK_INTERVAL_RSS << min(empty_streak, 4), RSS_MAX_INTERVAL)
+        next_tick += interval
+        now = time.monotonic()
+        if next_tick <= now:
+            # отстали на несколько интервалов — пропускаем их, а не догоняем пачкой
+            missed = int((now - next_tick) // interval) + 1
+            next_tick += missed * interval
+        # Reddit ответил 429 — следующий запрос не раньше его Retry-After
+        if rss_backoff_until > next_tick:
+            next_tick = rss_backoff_until
+        stop_event.wait(next_tick - now + random.uniform(0, RSS_JITTER))
+
+    shutdown()
+
+
+if __name__ == "__main__":
+    main()